@@ -0,0 +1,50 @@
+"""
+Cold storage for old chat messages in Civic-AI.
+Messages of chats that have been idle for a while are compacted into one
+compressed blob per chat, so the hot messages table only holds active history.
+Archived messages are rehydrated into the usual MessageResponse shape on read.
+"""
+
+import base64
+import json
+import zlib
+from typing import Iterable, List
+
+# Bump if the blob layout changes; unpack_messages refuses unknown versions
+ARCHIVE_FORMAT = 1
+
+
+def pack_messages(messages: List[dict]) -> str:
+    """
+    Compress a list of message dicts into a text-safe blob.
+    Stored as base64 text because PostgREST round-trips bytea awkwardly.
+    """
+    raw = json.dumps({"v": ARCHIVE_FORMAT, "messages": messages}, ensure_ascii=False, separators=(",", ":"))
+    return base64.b64encode(zlib.compress(raw.encode("utf-8"), 9)).decode("ascii")
+
+
+def unpack_messages(blob: str) -> List[dict]:
+    payload = json.loads(zlib.decompress(base64.b64decode(blob)).decode("utf-8"))
+    if payload.get("v") != ARCHIVE_FORMAT:
+        raise ValueError(f"Unsupported archive format: {payload.get('v')}")
+    return payload["messages"]
+
+
+def conversation_order(message: dict) -> tuple:
+    """
+    Sort key matching export.MESSAGE_ORDER. A question and its answer share
+    created_at, so the user's message is ranked first before falling back to id.
+    """
+    return (message["created_at"], 0 if message["sender"] == "user" else 1, message["id"])
+
+
+def merge_messages(*sources: Iterable[dict]) -> List[dict]:
+    """
+    Combine archived and hot messages into one list in conversation order,
+    keeping a single copy of any message present in both.
+    """
+    by_id = {}
+    for source in sources:
+        for message in source:
+            by_id[message["id"]] = message
+    return sorted(by_id.values(), key=conversation_order)
@@ -0,0 +1,392 @@
+"""
+Cache tier for Civic-AI.
+Two backends share one interface: an in-process LRU, and a SQLite store in
+shared memory (or on local disk) that every worker process on the node reads
+and writes, so adding workers does not multiply upstream calls.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form of a question for cache keys: case-folded, single-spaced,
+    without trailing punctuation.
+    """
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.!।").strip().casefold()
+
+
+def answer_cache_key(question: str, language: str) -> str:
+    return f"answer:{language.strip().lower()}:{normalize_question(question)}"
+
+
+class BaseCache:
+    """
+    Interface shared by the cache backends. Values must be JSON-serialisable.
+    `get_or_compute` coalesces concurrent misses for the same key within this
+    process; backends extend that across processes where they can.
+
+    `get` and `set` may raise backend errors. The async `aget`, `aset` and
+    `get_or_compute` never let a cache failure fail the caller: reads become
+    misses and writes are dropped.
+    """
+
+    # Whether get/set do I/O and must be kept off the event loop
+    blocking = True
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "errors": self.errors,
+        }
+
+    async def _call(self, func, *args) -> Any:
+        if self.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        try:
+            return await self._call(self.get, key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Cache read failed, treating as a miss: %s", e)
+            return None
+
+    async def aset(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            await self._call(self.set, key, value, ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Cache write failed, value not cached: %s", e)
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: float,
+                                 wait_timeout: Optional[float] = None) -> Any:
+        value = await compute()
+        await self.aset(key, value, ttl)
+        return value
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: float,
+                             wait_timeout: Optional[float] = None) -> Any:
+        """
+        Return the cached value for `key`, or run `compute()` once and cache
+        its result. Exceptions from `compute` are propagated and not cached.
+        `wait_timeout` is the caller's own budget for waiting on a computation
+        started by another request or worker; when it runs out, or that
+        computation fails, the caller computes the value itself.
+        """
+        value = await self.aget(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(inflight), wait_timeout)
+            except asyncio.CancelledError:
+                # Only the leader being cancelled is ours to recover from
+                if not inflight.cancelled():
+                    raise
+            except Exception:
+                pass
+            return await BaseCache._compute_and_store(self, key, compute, ttl)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._compute_and_store(key, compute, ttl, wait_timeout)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures are not reported as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+
+class MemoryCache(BaseCache):
+    """
+    Per-process LRU cache with TTLs.
+    """
+
+    blocking = False
+
+    def __init__(self, max_entries: int = 10000):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Node-wide cache in a memory-mapped SQLite file shared by all workers.
+    Misses take a short-lived lease row so only one worker computes a value
+    while the others wait for it to appear. Connections and the lease owner id
+    are created per process, so the cache is safe to build before workers fork.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, mmap_bytes: int = 256 * 1024 * 1024,
+                 lease_seconds: float = 30.0, poll_seconds: float = 0.05):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.mmap_bytes = mmap_bytes
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._owner = None
+        self._owner_pid = None
+        self._local = threading.local()
+        self._writes = 0
+
+        secure_cache_file(path)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_expires_idx ON entries (expires_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Connection for the current thread, reopened after a fork since SQLite
+        connections must not be shared across processes.
+        """
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            self._local.conn = self._connect()
+            self._local.pid = pid
+        return self._local.conn
+
+    @property
+    def owner(self) -> str:
+        pid = os.getpid()
+        if self._owner_pid != pid:
+            self._owner = uuid.uuid4().hex
+            self._owner_pid = pid
+        return self._owner
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires_at > ?",
+            (self._hash(key), time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (self._hash(key), json.dumps(value, ensure_ascii=False), time.time() + ttl),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        now = time.time()
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_entries:
+            # Drop the entries closest to expiry first
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def _try_lease(self, key: str) -> bool:
+        conn = self._conn()
+        now = time.time()
+        hashed = self._hash(key)
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (hashed, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+            (hashed, self.owner, now + self.lease_seconds),
+        )
+        return cursor.rowcount == 1
+
+    def _release_lease(self, key: str) -> None:
+        self._conn().execute(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", (self._hash(key), self.owner)
+        )
+
+    async def _lease(self, operation, key: str, default: bool) -> bool:
+        try:
+            return await asyncio.to_thread(operation, key)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Cache lease operation failed: %s", e)
+            return default
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: float,
+                                 wait_timeout: Optional[float] = None) -> Any:
+        wait = self.lease_seconds if wait_timeout is None else min(wait_timeout, self.lease_seconds)
+        give_up_at = time.monotonic() + wait
+        # A lease that cannot be taken because the store is failing counts as
+        # taken, so the value is computed here rather than waited for
+        while not await self._lease(self._try_lease, key, default=True):
+            # Another worker is computing this key; wait for its result
+            await asyncio.sleep(self.poll_seconds)
+            value = await self.aget(key)
+            if value is not None:
+                return value
+            if time.monotonic() >= give_up_at:
+                break
+
+        try:
+            # The previous lease holder may have finished just before we took over
+            value = await self.aget(key)
+            if value is not None:
+                return value
+            return await super()._compute_and_store(key, compute, ttl)
+        finally:
+            await self._lease(self._release_lease, key, default=False)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["path"] = self.path
+        return stats
+
+
+def _check_private(path: str, info: os.stat_result, is_dir: bool) -> None:
+    if (
+        (stat.S_ISDIR(info.st_mode) if is_dir else stat.S_ISREG(info.st_mode))
+        and info.st_uid == os.getuid()
+        and not info.st_mode & 0o077
+    ):
+        return
+    raise PermissionError(f"Refusing to use {path}: it must be owned by this user and private to it")
+
+
+def private_directory(path: str) -> str:
+    """
+    Create `path` as a directory only this user can use, refusing an existing
+    one that another user owns or that is open to others.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    if hasattr(os, "getuid"):
+        _check_private(path, os.lstat(path), is_dir=True)
+    return path
+
+
+def secure_cache_file(path: str) -> None:
+    """
+    Create the cache file readable by this user only, and refuse an existing
+    one that another user could have planted or can read.
+    The -wal and -shm files SQLite adds take the same permissions.
+    """
+    if not hasattr(os, "getuid"):
+        return
+    flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+    fd = os.open(path, flags, 0o600)
+    try:
+        _check_private(path, os.fstat(fd), is_dir=False)
+    finally:
+        os.close(fd)
+
+
+def default_cache_path(namespace: str) -> str:
+    """
+    Prefer tmpfs so the shared tier lives in memory; fall back to the temp dir.
+    The file sits in a private per-user directory, since both are writable by
+    every local user, and is named per namespace so deployments sharing a host
+    never share cached answers or sessions.
+    """
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    if hasattr(os, "getuid"):
+        base = private_directory(os.path.join(base, f"civic-ai-{os.getuid()}"))
+    safe_namespace = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace)
+    return os.path.join(base, f"civic-ai-cache-{safe_namespace}.sqlite3")
+
+
+def create_cache(backend: str = "sqlite", path: Optional[str] = None, max_entries: int = 50000,
+                 namespace: str = "default") -> BaseCache:
+    """
+    Build the configured cache backend, falling back to the in-process cache
+    if the shared store cannot be opened.
+    """
+    if backend == "sqlite":
+        try:
+            return SQLiteCache(path or default_cache_path(namespace), max_entries=max_entries)
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Failed to open shared cache, using in-process cache: %s", e)
+    return MemoryCache(max_entries=max_entries)
@@ -0,0 +1,165 @@
+"""
+Response compression and fast JSON serialisation for Civic-AI.
+Large Markdown answers and message histories are compressed with brotli or gzip
+depending on what the client accepts, and list endpoints skip the Pydantic
+round trip by serialising rows directly.
+"""
+
+import gzip
+import json
+from typing import Any, Iterable
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+# Content types worth compressing. Images and archives are already compressed.
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson", "application/javascript")
+
+
+def dumps(payload: Any) -> bytes:
+    """
+    Serialise a JSON payload to UTF-8 bytes using the fastest encoder available.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def project_rows(rows: Iterable[dict], model) -> list:
+    """
+    Keep only the fields declared on a response model, in declaration order.
+    Equivalent to FastAPI's response_model filtering without building model instances.
+    """
+    fields = tuple(model.model_fields)
+    return [{field: row.get(field) for field in fields} for row in rows]
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """
+    Pick the best supported content-coding from an Accept-Encoding header.
+    Returns an empty string when the response should be sent uncompressed.
+    """
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if token:
+            offered[token] = quality
+
+    wildcard = offered.get("*", 0.0)
+    if brotli is not None and offered.get("br", wildcard) > 0:
+        return "br"
+    if offered.get("gzip", wildcard) > 0:
+        return "gzip"
+    return ""
+
+
+def with_vary_accept_encoding(headers: list) -> list:
+    """
+    Response headers with Accept-Encoding added to Vary, so shared caches keep
+    compressed and uncompressed variants apart.
+    """
+    vary = b", ".join(value for key, value in headers if key.lower() == b"vary")
+    if b"accept-encoding" in vary.lower() or vary.strip() == b"*":
+        return headers
+    new_headers = [(key, value) for key, value in headers if key.lower() != b"vary"]
+    new_headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+    return new_headers
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses buffered responses above a size threshold.
+    Streaming responses and responses that already carry a Content-Encoding
+    are passed through untouched. Every other compressible response carries
+    Vary: Accept-Encoding, whether or not this particular one was compressed.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            response_headers = {key.lower(): value for key, value in start_message.get("headers", [])}
+            content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+
+            if (
+                message.get("more_body", False)
+                or b"content-encoding" in response_headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            vary_headers = with_vary_accept_encoding(list(start_message.get("headers", [])))
+            if not encoding or len(body) < self.minimum_size:
+                passthrough = True
+                await send({**start_message, "headers": vary_headers})
+                await send(message)
+                return
+
+            if encoding == "br":
+                compressed = brotli.compress(body, quality=self.brotli_quality)
+            else:
+                compressed = gzip.compress(body, compresslevel=self.gzip_level)
+
+            new_headers = [(key, value) for key, value in vary_headers if key.lower() != b"content-length"]
+            new_headers.append((b"content-encoding", encoding.encode("latin-1")))
+            new_headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+
+            await send({**start_message, "headers": new_headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,155 @@
+"""
+Request deadlines for Civic-AI.
+Every HTTP request gets a deadline that is shared by the auth, database and
+model stages; each blocking call only receives the budget that is left.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import time
+from concurrent.futures import Executor
+from typing import Optional
+
+# Client header carrying the caller's own timeout, in seconds
+DEADLINE_HEADER = b"x-request-timeout"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage runs out of request budget."""
+
+
+class Deadline:
+    """
+    Absolute point in time by which a request must be answered.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, cap: Optional[float] = None, reserve: float = 0.0) -> float:
+        """
+        Time available to one stage: what is left of the request, minus time
+        reserved for later stages, capped at the stage's own limit.
+        """
+        available = self.remaining() - reserve
+        if cap is not None:
+            available = min(available, cap)
+        return max(0.0, available)
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def stage_budget(cap: float, reserve: float = 0.0) -> float:
+    """
+    Budget for a stage of the current request. Outside a request (WebSocket
+    frames, background jobs) the stage simply gets its own cap.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return cap
+    return deadline.budget(cap, reserve)
+
+
+def in_executor(executor: Optional[Executor], func, *args, **kwargs) -> asyncio.Future:
+    """
+    Run a blocking call on `executor` (the loop's default executor when None),
+    carrying over context variables as `asyncio.to_thread` does.
+    """
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def run_blocking(func, *args, cap: float, reserve: float = 0.0, executor: Optional[Executor] = None,
+                       **kwargs):
+    """
+    Run a blocking call in a worker thread, bounded by the stage budget.
+    The thread itself cannot be killed, so callers should also pass the budget
+    to the client library's own timeout where one exists. Slow stages should
+    use their own `executor` so their stuck threads cannot delay other stages.
+    """
+    timeout = stage_budget(cap, reserve)
+    if timeout <= 0:
+        raise DeadlineExceeded(f"No time left to call {getattr(func, '__qualname__', func)}")
+    try:
+        return await asyncio.wait_for(in_executor(executor, func, *args, **kwargs), timeout)
+    except asyncio.TimeoutError as e:
+        raise DeadlineExceeded(
+            f"{getattr(func, '__qualname__', func)} did not finish within {timeout:.2f}s"
+        ) from e
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that sets the request deadline and enforces it as a hard
+    upper bound on handler latency. Paths in `exempt_paths` (long-lived
+    streams) get no request deadline; each of their calls is bounded only by
+    its stage cap.
+    """
+
+    def __init__(self, app, default_timeout: float = 30.0, max_timeout: float = 60.0,
+                 grace: float = 0.5, exempt_paths: tuple = ()):
+        self.app = app
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        self.grace = grace
+        self.exempt_paths = exempt_paths
+
+    def _timeout_for(self, scope) -> float:
+        for key, value in scope.get("headers") or []:
+            if key == DEADLINE_HEADER:
+                try:
+                    requested = float(value.decode("latin-1"))
+                except ValueError:
+                    break
+                if requested > 0:
+                    return min(requested, self.max_timeout)
+                break
+        return self.default_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith(self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(self._timeout_for(scope))
+        token = _current_deadline.set(deadline)
+        try:
+            response_started = False
+
+            async def send_wrapper(message):
+                nonlocal response_started
+                if message["type"] == "http.response.start":
+                    response_started = True
+                await send(message)
+
+            try:
+                await asyncio.wait_for(self.app(scope, receive, send_wrapper), deadline.timeout + self.grace)
+            except asyncio.TimeoutError:
+                if response_started:
+                    return
+                body = json.dumps({"detail": "Request deadline exceeded"}).encode("utf-8")
+                await send({
+                    "type": "http.response.start",
+                    "status": 504,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("latin-1")),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+        finally:
+            _current_deadline.reset(token)
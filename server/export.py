@@ -0,0 +1,75 @@
+"""
+Streaming NDJSON export for Civic-AI.
+Rows are read page by page with keyset cursors and written out as they
+arrive, so memory use does not grow with history size.
+"""
+
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from compression import dumps
+
+Cursor = Tuple[str, ...]
+# Sort order as (column, descending) pairs, ending in a unique column
+Order = Tuple[Tuple[str, bool], ...]
+
+CHAT_ORDER: Order = (("created_at", False), ("id", False))
+# A question and its answer are inserted together and share created_at;
+# sender descending ('user' before 'ai') keeps them in conversation order
+MESSAGE_ORDER: Order = (("created_at", False), ("sender", True), ("id", False))
+
+
+def keyset_filter(cursor: Cursor, order: Order = CHAT_ORDER) -> str:
+    """
+    PostgREST `or` filter selecting rows strictly after `cursor` in `order`.
+    Values are quoted because timestamps contain reserved characters.
+    """
+    clauses = []
+    for index, (column, descending) in enumerate(order):
+        equal = [f'{previous}.eq."{value}"' for (previous, _), value in zip(order[:index], cursor)]
+        after = f'{column}.{"lt" if descending else "gt"}."{cursor[index]}"'
+        clauses.append(f'and({",".join(equal + [after])})' if equal else after)
+    return ",".join(clauses)
+
+
+async def keyset_pages(
+    fetch_page: Callable[[Optional[Cursor], int], Awaitable[List[dict]]],
+    page_size: int,
+    order: Order = CHAT_ORDER,
+) -> AsyncIterator[List[dict]]:
+    """
+    Yield successive pages from `fetch_page(cursor, page_size)`, using the
+    `order` columns of the last row of each page as the cursor for the next.
+    """
+    cursor = None
+    while True:
+        rows = await fetch_page(cursor, page_size)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
+        cursor = tuple(last[column] for column, _ in order)
+
+
+def ndjson_lines(records: List[dict]) -> bytes:
+    return b"".join(dumps(record) + b"\n" for record in records)
+
+
+async def encode_ndjson(batches: AsyncIterator[List[dict]], compress: bool = False) -> AsyncIterator[bytes]:
+    """
+    Encode batches of records as NDJSON, optionally as one continuous gzip
+    stream flushed after every batch so clients can decode incrementally.
+    """
+    if not compress:
+        async for records in batches:
+            yield ndjson_lines(records)
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    async for records in batches:
+        chunk = compressor.compress(ndjson_lines(records)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if chunk:
+            yield chunk
+    yield compressor.flush(zlib.Z_FINISH)
@@ -4,6 +4,9 @@ Fallback content for Civic-AI when AI services are unavailable.
 Contains information about popular Indian government schemes.
 """
 
+from functools import lru_cache
+from typing import Optional
+
 FALLBACK_SCHEMES = {
     "kisan": {
         "title": "PM Kisan Samman Nidhi Yojana",
@@ -90,25 +93,32 @@ GENERAL_FALLBACK = {
     "note": "Please try your specific query again in a few moments."
 }
 
-def get_fallback_response(query: str, language: str = "en") -> str:
+def select_fallback_scheme(query: str) -> Optional[str]:
     """
-    Selects a smart fallback response based on keywords in the query.
+    Picks the FALLBACK_SCHEMES key matching keywords in the query, if any.
     """
     query_lower = query.lower()
     
     # Keyword matching
-    selected_scheme = None
-    
     if "kisan" in query_lower or "farm" in query_lower or "agri" in query_lower:
-        selected_scheme = FALLBACK_SCHEMES["kisan"]
+        return "kisan"
     elif "health" in query_lower or "medic" in query_lower or "doctor" in query_lower or "hospital" in query_lower or "ayushman" in query_lower:
-        selected_scheme = FALLBACK_SCHEMES["health"]
+        return "health"
     elif "house" in query_lower or "home" in query_lower or "awas" in query_lower or "flat" in query_lower:
-        selected_scheme = FALLBACK_SCHEMES["housing"]
+        return "housing"
     elif "loan" in query_lower or "money" in query_lower or "business" in query_lower or "mudra" in query_lower:
-        selected_scheme = FALLBACK_SCHEMES["business"]
+        return "business"
     elif "gas" in query_lower or "lpg" in query_lower or "cooking" in query_lower or "ujjwala" in query_lower:
-        selected_scheme = FALLBACK_SCHEMES["gas"]
+        return "gas"
+    return None
+
+@lru_cache(maxsize=128)
+def render_fallback(scheme_key: Optional[str], language: str = "en") -> str:
+    """
+    Renders the Markdown fallback for a scheme (or the general notice).
+    Cached, since there are only a handful of scheme/language combinations.
+    """
+    selected_scheme = FALLBACK_SCHEMES.get(scheme_key) if scheme_key else None
     
     # Construct the response
     if selected_scheme:
@@ -146,6 +156,12 @@ def get_fallback_response(query: str, language: str = "en") -> str:
     response += f"\n*{GENERAL_FALLBACK['note']}*"
     return response
 
+def get_fallback_response(query: str, language: str = "en") -> str:
+    """
+    Selects a smart fallback response based on keywords in the query.
+    """
+    return render_fallback(select_fallback_scheme(query), language)
+
 def get_image_fallback_response(language: str = "en") -> dict:
     """
     Returns a simulated image analysis response.
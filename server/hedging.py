@@ -0,0 +1,135 @@
+"""
+Hedged requests for Civic-AI.
+When a model call is slower than the observed tail latency, a second identical
+call is sent and whichever answers first wins. A budget keeps the extra calls
+to a fixed share of the traffic.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+
+class LatencyTracker:
+    """
+    Sliding window of primary call latencies, in seconds.
+    """
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Latency below which a fraction `q` of recent calls finished, or None
+        until enough calls have been observed.
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+class HedgeBudget:
+    """
+    Token bucket that earns `max_extra_percent`/100 of a hedge per primary call,
+    so hedges never exceed that share of traffic beyond a small burst.
+    """
+
+    def __init__(self, max_extra_percent: float, burst: float = 10.0):
+        self.rate = max_extra_percent / 100.0
+        self.burst = burst
+        self.tokens = 0.0
+
+    def record_request(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.rate)
+
+    def try_acquire(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class Hedger:
+    """
+    Runs an async call, hedging it with a duplicate once it is slower than the
+    configured latency percentile.
+
+    Losing calls are cancelled. A call that is already running in a worker
+    thread keeps going until its own client timeout, but its result is discarded.
+    """
+
+    def __init__(self, enabled: bool = False, percentile: float = 0.9, max_extra_percent: float = 5.0,
+                 min_delay: float = 0.05, tracker: Optional[LatencyTracker] = None):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.tracker = tracker or LatencyTracker()
+        self.budget = HedgeBudget(max_extra_percent)
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    async def _timed(self, call: Callable[[], Awaitable]):
+        """
+        Await a primary call and record how long it ran, however it ended.
+        Failed, timed-out and cancelled primaries are the slow tail; leaving
+        them out would pull the hedge delay down. Hedges are not recorded.
+        """
+        started = time.monotonic()
+        try:
+            return await call()
+        finally:
+            self.tracker.record(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        delay = self.tracker.percentile(self.percentile)
+        return {
+            "enabled": self.enabled,
+            "hedge_delay_seconds": round(delay, 3) if delay is not None else None,
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "budget_tokens": round(self.budget.tokens, 2),
+        }
+
+    async def run(self, call: Callable[[], Awaitable]):
+        """
+        Await `call()`, sending one duplicate if it outlives the hedge delay.
+        `call` must be safe to invoke twice.
+        """
+        self.budget.record_request()
+        delay = self.tracker.percentile(self.percentile)
+        if not self.enabled or delay is None:
+            return await self._timed(call)
+
+        primary = asyncio.ensure_future(self._timed(call))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(delay, self.min_delay))
+            if done or not self.budget.try_acquire():
+                return await primary
+
+            hedge = asyncio.ensure_future(call())
+            tasks.add(hedge)
+            self.hedges_sent += 1
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        if task is hedge:
+                            self.hedges_won += 1
+                        return task.result()
+
+            # Both calls failed; surface the primary's error
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
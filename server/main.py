@@ -1,25 +1,103 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 import os
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
+from fastapi.responses import StreamingResponse
+from supabase import acreate_client, create_client, Client, ClientOptions
 from typing import Optional
+from contextlib import asynccontextmanager
 import logging
 from PIL import Image
 import io
+import json
+import asyncio
+import time
 import platform
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from fallbacks import get_fallback_response, get_image_fallback_response
+from realtime import ChatConnection, ChatHub
+from compression import CompressionMiddleware, FastJSONResponse, project_rows
+from deadlines import DeadlineExceeded, DeadlineMiddleware, in_executor, run_blocking, stage_budget
+from hedging import Hedger
+from export import CHAT_ORDER, MESSAGE_ORDER, encode_ndjson, keyset_filter, keyset_pages
+from cache import answer_cache_key, create_cache
+from warmup import WarmupJob, load_questions_file, top_questions
+from archive import merge_messages, pack_messages, unpack_messages
+from readiness import DependencyProbe, ReadinessMonitor
+from structured_logging import (
+    RequestLogMiddleware,
+    bind_log_context,
+    configure_logging,
+    new_log_context,
+    parse_sample_rates,
+)
 
 # Load environment variables first
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: JSON records are queued and written by a background thread
+log_handler = configure_logging(
+    level=logging.INFO,
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Civic-AI Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start background jobs with the worker and stop them on shutdown
+    """
+    warmup_task = None
+    if WARMUP_ENABLED and gemini_api_key:
+        warmup_task = asyncio.create_task(warmup_job.run(load_warmup_questions))
+        if WARMUP_BLOCK_STARTUP:
+            # Hold back startup (and so the listening socket) until the cache is warm
+            try:
+                await asyncio.wait_for(asyncio.shield(warmup_task), WARMUP_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning("Cache warm-up still running after %ss; starting anyway", WARMUP_TIMEOUT_SECONDS)
+    else:
+        warmup_job.disable()
+    
+    archive_task = asyncio.create_task(archive_loop()) if ARCHIVE_AFTER_DAYS > 0 else None
+    probe_task = asyncio.create_task(readiness_monitor.run())
+    fanout_task = asyncio.create_task(realtime_fanout_loop()) if REALTIME_FANOUT_ENABLED else None
+    
+    yield
+    
+    for task in (warmup_task, archive_task, probe_task, fanout_task):
+        if task and not task.done():
+            task.cancel()
+    model_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="Civic-AI Backend", version="1.0.0", lifespan=lifespan)
+
+# Request deadline, split across the auth, database and model stages.
+# Clients may ask for a shorter (never longer than the max) budget with X-Request-Timeout.
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "30"))
+REQUEST_TIMEOUT_MAX_SECONDS = float(os.getenv("REQUEST_TIMEOUT_MAX_SECONDS", "60"))
+AUTH_TIMEOUT_SECONDS = float(os.getenv("AUTH_TIMEOUT_SECONDS", "5"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "5"))
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "25"))
+# Time kept back from the model so the answer can still be saved
+MODEL_RESERVE_SECONDS = float(os.getenv("MODEL_RESERVE_SECONDS", "2"))
+
+# Gemini calls run on their own threads: calls that outlive their budget keep a
+# thread busy until the client timeout, and must not delay auth or database calls
+MODEL_MAX_THREADS = int(os.getenv("MODEL_MAX_THREADS", "16"))
+model_executor = ThreadPoolExecutor(max_workers=MODEL_MAX_THREADS, thread_name_prefix="gemini")
+
+# Added before CORS so that deadline 504s still carry CORS headers
+app.add_middleware(
+    DeadlineMiddleware,
+    default_timeout=REQUEST_TIMEOUT_SECONDS,
+    max_timeout=REQUEST_TIMEOUT_MAX_SECONDS,
+    exempt_paths=("/api/export",),
+)
 
 # Configure CORS
 app.add_middleware(
@@ -30,6 +108,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large answers and histories for clients on slow mobile links
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")),
+)
+
+# Outermost, so logged latency covers every other middleware.
+# Success logs are sampled per route, e.g. LOG_SAMPLE_RATES="/api/query=0.1,/health=0"
+app.add_middleware(
+    RequestLogMiddleware,
+    default_rate=float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "1.0")),
+    route_rates=parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")),
+)
+
 # Initialize Supabase client
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_anon_key = os.getenv("SUPABASE_ANON_KEY")
@@ -37,7 +129,8 @@ supabase_anon_key = os.getenv("SUPABASE_ANON_KEY")
 if not supabase_url or not supabase_anon_key:
     raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables")
 
-supabase: Client = create_client(supabase_url, supabase_anon_key)
+supabase_options = ClientOptions(postgrest_client_timeout=DB_TIMEOUT_SECONDS)
+supabase: Client = create_client(supabase_url, supabase_anon_key, options=supabase_options)
 
 # Initialize Supabase Admin client (for bypassing RLS)
 supabase_service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
@@ -45,10 +138,10 @@ supabase_admin: Optional[Client] = None
 
 if supabase_service_role_key:
     try:
-        supabase_admin = create_client(supabase_url, supabase_service_role_key)
+        supabase_admin = create_client(supabase_url, supabase_service_role_key, options=supabase_options)
         logger.info("Supabase Admin client initialized successfully")
     except Exception as e:
-        logger.error(f"Failed to initialize Supabase Admin client: {e}")
+        logger.error("Failed to initialize Supabase Admin client: %s", e)
 else:
     logger.warning("SUPABASE_SERVICE_ROLE_KEY not set. Admin operations may fail due to RLS.")
 
@@ -61,13 +154,76 @@ if gemini_api_key:
         genai.configure(api_key=gemini_api_key)
         logger.info("initialized successfully")
     except Exception as e:
-        logger.error(f"Failed to initialize: {e}")
+        logger.error("Failed to initialize: %s", e)
 else:
     logger.warning(" AI features will use fallback responses.")
 
+# Hedged model requests: a duplicate call goes out once the first is slower than
+# the observed HEDGE_PERCENTILE latency, capped at HEDGE_MAX_EXTRA_PERCENT of calls
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_MAX_EXTRA_PERCENT = float(os.getenv("HEDGE_MAX_EXTRA_PERCENT", "5"))
+
+text_model_hedger = Hedger(HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MAX_EXTRA_PERCENT)
+vision_model_hedger = Hedger(HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MAX_EXTRA_PERCENT)
+
 # Security
 security = HTTPBearer()
 
+# Cache tier shared by every worker on the node (CACHE_BACKEND=memory for per-process only).
+# Without CACHE_PATH the file is per CACHE_NAMESPACE, which defaults to one per Supabase
+# project, so staging and production on the same host stay apart.
+cache = create_cache(
+    backend=os.getenv("CACHE_BACKEND", "sqlite"),
+    path=os.getenv("CACHE_PATH"),
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "50000")),
+    namespace=os.getenv("CACHE_NAMESPACE") or hashlib.sha256(supabase_url.encode("utf-8")).hexdigest()[:12],
+)
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+
+# Answer cache warm-up at startup, from chat history or WARMUP_FILE (JSON lines)
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_BLOCK_STARTUP = os.getenv("WARMUP_BLOCK_STARTUP", "false").lower() == "true"
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "120"))
+WARMUP_FILE = os.getenv("WARMUP_FILE")
+WARMUP_LANGUAGES = [language.strip() for language in os.getenv("WARMUP_LANGUAGES", "en").split(",") if language.strip()]
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "50"))
+WARMUP_SCAN_LIMIT = int(os.getenv("WARMUP_SCAN_LIMIT", "5000"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+
+# Realtime chat channel
+chat_hub = ChatHub()
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+WS_AUTH_TIMEOUT_SECONDS = float(os.getenv("WS_AUTH_TIMEOUT_SECONDS", "10"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "256"))
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "4"))
+# Relay messages saved by other workers and nodes through Supabase Realtime.
+# Needs the service role key and the messages table in the supabase_realtime publication (see SQL below).
+REALTIME_FANOUT_ENABLED = os.getenv("REALTIME_FANOUT_ENABLED", "true").lower() == "true" and bool(supabase_service_role_key)
+REALTIME_RETRY_SECONDS = float(os.getenv("REALTIME_RETRY_SECONDS", "5"))
+REALTIME_SUBSCRIBE_TIMEOUT_SECONDS = float(os.getenv("REALTIME_SUBSCRIBE_TIMEOUT_SECONDS", "10"))
+
+# Database Helper Functions
+def _db() -> Client:
+    """
+    Admin client when available (bypasses RLS), otherwise the anon client
+    """
+    return supabase_admin if supabase_admin else supabase
+
+async def db_execute(query):
+    """
+    Execute a Supabase query off the event loop within the database stage budget
+    """
+    return await run_blocking(query.execute, cap=DB_TIMEOUT_SECONDS)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    logger.warning("Deadline exceeded on %s: %s", request.url.path, exc)
+    return FastJSONResponse({"detail": "Request deadline exceeded"}, status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+
 # Pydantic Models
 class SignUpRequest(BaseModel):
     name: str
@@ -119,37 +275,51 @@ class OCRResponse(BaseModel):
     chat_id: Optional[str] = None
 
 # Auth Helper Functions
+async def _load_user_profile(token: str) -> dict:
+    """
+    Resolve a token to the user's profile row with Supabase
+    """
+    # Get user from Supabase using the token
+    user_response = await run_blocking(supabase.auth.get_user, token, cap=AUTH_TIMEOUT_SECONDS)
+    
+    if not user_response.user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    # Get user profile from database
+    profile_response = await db_execute(_db().table("users").select("*").eq("id", user_response.user.id))
+    
+    if not profile_response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User profile not found"
+        )
+    
+    return profile_response.data[0]
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
     Validate JWT token and return current user
     """
     try:
-        # Get user from Supabase using the token
-        user_response = supabase.auth.get_user(credentials.credentials)
-        
-        if not user_response.user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
-        # Get user profile from database
-        if supabase_admin:
-            profile_response = supabase_admin.table("users").select("*").eq("id", user_response.user.id).execute()
-        else:
-            profile_response = supabase.table("users").select("*").eq("id", user_response.user.id).execute()
-        
-        if not profile_response.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User profile not found"
-            )
+        # Verified profiles are cached briefly so repeat requests skip both Supabase calls
+        profile = await cache.get_or_compute(
+            f"auth:{credentials.credentials}",
+            lambda: _load_user_profile(credentials.credentials),
+            ttl=AUTH_CACHE_TTL_SECONDS,
+            wait_timeout=stage_budget(AUTH_TIMEOUT_SECONDS),
+        )
         
-        return profile_response.data[0]
+        bind_log_context(user_id=profile["id"])
+        return profile
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Authentication error: {str(e)}")
+        logger.error("Authentication error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
@@ -157,16 +327,11 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
 
 # AI Helper Functions
-def generate_ai_response(text: str, language: str = "en") -> str:
+def build_query_prompt(text: str, language: str = "en") -> str:
     """
-    Generate AI response for government/legal text using Google Gemini
+    Build the Gemini prompt used for text questions
     """
-    try:
-        if gemini_api_key:
-            # Use Gemini for responses - using gemini-1.5-flash for better performance
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
-            prompt = f"""
+    return f"""
             You are Civic-AI, an expert AI assistant dedicated to helping citizens understand government schemes, legal notices, and public services in India.
             
             Your task is to explain the following text in simple, clear, and easy-to-understand language.
@@ -183,90 +348,304 @@ def generate_ai_response(text: str, language: str = "en") -> str:
             
             Format your response in Markdown.
             """
-            
-            response = model.generate_content(prompt)
-            return response.text
+
+async def call_model(contents, **kwargs):
+    """
+    Call Gemini with whatever is left of the model stage budget.
+    Raises DeadlineExceeded when the budget is exhausted.
+    """
+    # Use gemini-1.5-flash for better performance
+    model = genai.GenerativeModel('gemini-1.5-flash')
+    budget = stage_budget(MODEL_TIMEOUT_SECONDS, reserve=MODEL_RESERVE_SECONDS)
+    return await run_blocking(
+        model.generate_content,
+        contents,
+        cap=budget,
+        executor=model_executor,
+        request_options={"timeout": budget},
+        **kwargs
+    )
+
+async def cached_model_answer(text: str, language: str = "en") -> str:
+    """
+    Gemini answer for a question, shared across workers through the cache.
+    Raises on model errors so fallbacks are never cached.
+    """
+    prompt = build_query_prompt(text, language)
+    
+    async def _answer():
+        response = await text_model_hedger.run(lambda: call_model(prompt))
+        return response.text
+    
+    return await cache.get_or_compute(
+        answer_cache_key(text, language),
+        _answer,
+        ttl=ANSWER_CACHE_TTL_SECONDS,
+        wait_timeout=stage_budget(MODEL_TIMEOUT_SECONDS, reserve=MODEL_RESERVE_SECONDS),
+    )
+
+async def generate_ai_response(text: str, language: str = "en") -> str:
+    """
+    Generate AI response for government/legal text using Google Gemini
+    """
+    try:
+        if gemini_api_key:
+            return await cached_model_answer(text, language)
         else:
             logger.warning("Gemini API key missing during request. Using fallback.")
             # Fallback response without Gemini
+            bind_log_context(fallback=True)
             return generate_fallback_response(text, language)
     
     except Exception as e:
-        logger.error(f"AI response generation error: {str(e)}")
+        logger.error("AI response generation error: %s", e)
+        bind_log_context(fallback=True)
         return generate_fallback_response(text, language)
 
+def build_image_prompt(language: str = "en") -> str:
+    """
+    Build the Gemini Vision prompt used for document images
+    """
+    return f"""
+                You are Civic-AI, an expert AI assistant.
+                
+                Please analyze this image of a government document or notice.
+                
+                Return a JSON response with two fields:
+                1. "extracted_text": The full text extracted from the image.
+                2. "explanation": A simple, clear explanation of what the document is about, including key actions, dates, or requirements.
+                
+                The "explanation" should be in {language} and formatted in Markdown.
+                """
+
+async def analyze_document_image(image, language: str = "en") -> dict:
+    """
+    Extract and explain the text of a document image with Gemini Vision.
+    Raises on model errors or an exhausted budget so callers can use the image fallback.
+    """
+    prompt = build_image_prompt(language)
+    # Each attempt gets its own copy of the image since hedged calls encode it concurrently
+    response = await vision_model_hedger.run(lambda: call_model(
+        [prompt, image.copy()],
+        generation_config={"response_mime_type": "application/json"}
+    ))
+    
+    try:
+        response_data = json.loads(response.text)
+        return {
+            "extracted_text": response_data.get("extracted_text", "Text could not be extracted."),
+            "explanation": response_data.get("explanation", "Analysis could not be generated."),
+        }
+    except Exception as json_error:
+        logger.error("JSON parsing error: %s", json_error)
+        return {
+            "extracted_text": "Error parsing AI response.",
+            "explanation": response.text,  # Fallback to raw text
+        }
+
+def stream_ai_response(text: str, language: str = "en"):
+    """
+    Yield the Gemini answer in chunks as they are generated.
+    Raises if Gemini is unavailable so callers can switch to the fallback.
+    """
+    if not gemini_api_key:
+        raise RuntimeError("Gemini API key missing")
+    model = genai.GenerativeModel('gemini-1.5-flash')
+    request_options = {"timeout": stage_budget(MODEL_TIMEOUT_SECONDS)}
+    for chunk in model.generate_content(build_query_prompt(text, language), stream=True, request_options=request_options):
+        if chunk.text:
+            yield chunk.text
+
 def generate_fallback_response(text: str, language: str = "en") -> str:
     """
     Generate a fallback response when Gemini is not available
     """
     return get_fallback_response(text, language)
 
+# Cache Warm-up
+async def load_warmup_questions() -> list:
+    """
+    Most frequent questions to pre-answer, from WARMUP_FILE or recent user messages.
+    Messages do not record their language, so mined questions are warmed for
+    every language in WARMUP_LANGUAGES.
+    """
+    if WARMUP_FILE:
+        return await asyncio.to_thread(load_questions_file, WARMUP_FILE, WARMUP_LANGUAGES, WARMUP_TOP_N)
+    
+    response = await db_execute(
+        _db().table("messages").select("content").eq("sender", "user")
+        .order("created_at", desc=True).limit(WARMUP_SCAN_LIMIT)
+    )
+    return top_questions((row["content"] for row in response.data or []), WARMUP_LANGUAGES, WARMUP_TOP_N)
+
+async def _answer_is_cached(question: str, language: str) -> bool:
+    return await cache.aget(answer_cache_key(question, language)) is not None
+
+warmup_job = WarmupJob(
+    answer=cached_model_answer,
+    is_cached=_answer_is_cached,
+    concurrency=WARMUP_CONCURRENCY,
+)
+
+# Chat Persistence Helpers
+async def _chat_is_owned_by(chat_id: str, user_id: str) -> bool:
+    chat_check = await db_execute(_db().table("chats").select("id").eq("id", chat_id).eq("user_id", user_id))
+    return bool(chat_check.data)
+
+async def _create_chat(user_id: str, title: str) -> Optional[str]:
+    chat_res = await db_execute(_db().table("chats").insert({"user_id": user_id, "title": title}))
+    return chat_res.data[0]["id"] if chat_res.data else None
+
+async def persist_chat_messages(chat_id: str, messages: list, exclude: Optional[ChatConnection] = None) -> list:
+    """
+    Save messages to a chat, bump its timestamp and push them to live subscribers
+    """
+    inserted = await db_execute(_db().table("messages").insert(messages))
+    await db_execute(_db().table("chats").update({"updated_at": "now()"}).eq("id", chat_id))
+
+    saved = project_rows(inserted.data or [], MessageResponse)
+    for message in saved:
+        chat_hub.publish_message(chat_id, message, exclude=exclude)
+    return saved
+
+def _relay_message_insert(payload: dict) -> None:
+    """
+    Supabase Realtime callback for inserts into messages, from any worker or node
+    """
+    data = payload.get("data", payload)
+    record = data.get("record") or data.get("new")
+    if record and record.get("id"):
+        chat_hub.publish_remote_message(project_rows([record], MessageResponse)[0])
+
+async def realtime_fanout_loop() -> None:
+    """
+    Keep a Supabase Realtime subscription to message inserts open, reconnecting on failure.
+    Until it is connected only messages saved by this process reach its sockets.
+    """
+    while True:
+        client = None
+        own_listener = None
+        try:
+            client = await acreate_client(supabase_url, supabase_service_role_key)
+            realtime = client.realtime
+            await realtime.connect()
+            # Newer realtime releases start reading the socket in connect();
+            # 2.0.x does not, so read it ourselves or no reply ever arrives
+            listener = getattr(realtime, "_listen_task", None)
+            if listener is None:
+                listener = own_listener = asyncio.create_task(realtime.listen())
+            
+            subscribed = asyncio.Event()
+            
+            def _on_subscribe(state, error=None):
+                if getattr(state, "value", state) == "SUBSCRIBED":
+                    subscribed.set()
+            
+            channel = client.channel("civic-ai-messages")
+            channel.on_postgres_changes("INSERT", schema="public", table="messages", callback=_relay_message_insert)
+            await channel.subscribe(_on_subscribe)
+            # A join reply proves events are actually being read
+            await asyncio.wait_for(subscribed.wait(), REALTIME_SUBSCRIBE_TIMEOUT_SECONDS)
+            logger.info("Realtime message fan-out connected")
+            
+            while realtime.is_connected and not listener.done():
+                await asyncio.wait({listener}, timeout=REALTIME_RETRY_SECONDS)
+            logger.warning("Realtime message fan-out disconnected")
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.error("Realtime message fan-out was not confirmed within %ss", REALTIME_SUBSCRIBE_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error("Realtime message fan-out error: %s", e)
+        finally:
+            if own_listener is not None:
+                own_listener.cancel()
+            if client is not None:
+                try:
+                    await client.remove_all_channels()
+                except Exception:
+                    pass
+        await asyncio.sleep(REALTIME_RETRY_SECONDS)
+
 # Routes
 @app.get("/")
 def root():
     return {"status": "Civic-AI Backend is running", "message": "API is ready to serve requests"}
 
+# Auth Routes
+# When the on_auth_user_created trigger (see SQL below) is installed, profile rows
+# are written by the database in the same transaction as the auth user
+PROFILE_TRIGGER_ENABLED = os.getenv("PROFILE_TRIGGER_ENABLED", "false").lower() == "true"
+
+async def _ensure_profile(user_id: str, name: str, email: str):
+    """
+    Create the public.users row for a new account.
+    Upserts so it is harmless if the trigger got there first.
+    """
+    if not supabase_admin:
+        # Fallback to anon client (will likely fail with RLS)
+        logger.warning("Using anon client for user profile creation. This may fail due to RLS.")
+    profile_response = await db_execute(
+        _db().table("users").upsert({"id": user_id, "name": name, "email": email}, on_conflict="id")
+    )
+    if not profile_response.data:
+        # If profile creation fails, we should ideally clean up the auth user
+        logger.error("Failed to create user profile")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to create user profile"
+        )
+
 @app.post("/auth/signup", response_model=AuthResponse)
 async def signup(request: SignUpRequest):
     """
     Create a new user account
     """
     try:
-        # Create user with Supabase Auth
-        auth_response = supabase.auth.sign_up({
+        credentials = {
             "email": request.email,
             "password": request.password
-        })
+        }
+        
+        if supabase_admin:
+            # Create an already-confirmed user in one call (Hackathon mode),
+            # with the name in its metadata so the profile trigger and login can read it
+            auth_response = await run_blocking(supabase_admin.auth.admin.create_user, {
+                **credentials,
+                "email_confirm": True,
+                "user_metadata": {"name": request.name}
+            }, cap=AUTH_TIMEOUT_SECONDS)
+        else:
+            auth_response = await run_blocking(supabase.auth.sign_up, {
+                **credentials,
+                "options": {"data": {"name": request.name}}
+            }, cap=AUTH_TIMEOUT_SECONDS)
         
         if not auth_response.user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to create user account"
             )
-            
-        # Auto-confirm email if admin client is available (Hackathon mode)
-        session = auth_response.session
-        if supabase_admin:
-            try:
-                logger.info(f"Auto-confirming email for user {auth_response.user.id}")
-                supabase_admin.auth.admin.update_user_by_id(
-                    auth_response.user.id,
-                    {"email_confirm": True}
-                )
-                
-                # If session is missing (due to email confirmation requirement), try to login now
-                if not session:
-                    # Login to get the session
-                    login_response = supabase.auth.sign_in_with_password({
-                        "email": request.email,
-                        "password": request.password
-                    })
-                    session = login_response.session
-            except Exception as e:
-                logger.warning(f"Failed to auto-confirm email or login: {e}")
         
-        # Store user profile in database
-        user_data = {
-            "id": auth_response.user.id,
-            "name": request.name,
-            "email": request.email
-        }
+        # Signing in and creating the profile both only need the new user id, so run them together
+        session = getattr(auth_response, "session", None)
+        steps = []
+        if not session:
+            steps.append(run_blocking(supabase.auth.sign_in_with_password, credentials, cap=AUTH_TIMEOUT_SECONDS))
+        if not PROFILE_TRIGGER_ENABLED:
+            steps.append(_ensure_profile(auth_response.user.id, request.name, request.email))
         
-        # Use admin client if available to bypass RLS
-        if supabase_admin:
-            profile_response = supabase_admin.table("users").insert(user_data).execute()
-        else:
-            # Fallback to anon client (will likely fail with RLS)
-            logger.warning("Using anon client for user profile creation. This may fail due to RLS.")
-            profile_response = supabase.table("users").insert(user_data).execute()
+        results = await asyncio.gather(*steps, return_exceptions=True)
         
-        if not profile_response.data:
-            # If profile creation fails, we should ideally clean up the auth user
-            logger.error("Failed to create user profile")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to create user profile"
-            )
+        if not session and results:
+            login_result = results[0]
+            if isinstance(login_result, Exception):
+                logger.warning("Failed to sign in after signup: %s", login_result)
+            else:
+                session = login_result.session
+        
+        if not PROFILE_TRIGGER_ENABLED and isinstance(results[-1], BaseException):
+            raise results[-1]
         
         return AuthResponse(
             access_token=session.access_token if session else "",
@@ -278,9 +657,12 @@ async def signup(request: SignUpRequest):
             message="Account created successfully"
         )
     
+    except (HTTPException, DeadlineExceeded):
+        raise
     except Exception as e:
-        logger.error(f"Signup error: {str(e)}")
-        if "already registered" in str(e).lower():
+        logger.error("Signup error: %s", e)
+        message = str(e).lower()
+        if "already registered" in message or "already been registered" in message:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
@@ -297,10 +679,10 @@ async def login(request: LoginRequest):
     """
     try:
         # Authenticate with Supabase
-        auth_response = supabase.auth.sign_in_with_password({
+        auth_response = await run_blocking(supabase.auth.sign_in_with_password, {
             "email": request.email,
             "password": request.password
-        })
+        }, cap=AUTH_TIMEOUT_SECONDS)
         
         if not auth_response.user or not auth_response.session:
             raise HTTPException(
@@ -308,26 +690,28 @@ async def login(request: LoginRequest):
                 detail="Invalid email or password"
             )
         
-        # Get user profile
-        if supabase_admin:
-            profile_response = supabase_admin.table("users").select("*").eq("id", auth_response.user.id).execute()
-        else:
-            profile_response = supabase.table("users").select("*").eq("id", auth_response.user.id).execute()
-        
-        user_profile = profile_response.data[0] if profile_response.data else {}
+        # The name comes from the verified identity's metadata; only accounts
+        # created before it was stored there need the profile lookup
+        name = (auth_response.user.user_metadata or {}).get("name")
+        if name is None:
+            profile_response = await db_execute(_db().table("users").select("name").eq("id", auth_response.user.id))
+            user_profile = profile_response.data[0] if profile_response.data else {}
+            name = user_profile.get("name", "")
         
         return AuthResponse(
             access_token=auth_response.session.access_token,
             user={
                 "id": auth_response.user.id,
                 "email": auth_response.user.email,
-                "name": user_profile.get("name", "")
+                "name": name
             },
             message="Login successful"
         )
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         if "invalid" in str(e).lower() or "credentials" in str(e).lower():
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -357,14 +741,13 @@ async def get_chats(current_user: dict = Depends(get_current_user)):
     Get all chats for the current user
     """
     try:
-        if supabase_admin:
-            response = supabase_admin.table("chats").select("*").eq("user_id", current_user["id"]).order("updated_at", desc=True).execute()
-        else:
-            response = supabase.table("chats").select("*").eq("user_id", current_user["id"]).order("updated_at", desc=True).execute()
+        response = await db_execute(_db().table("chats").select("*").eq("user_id", current_user["id"]).order("updated_at", desc=True))
         
-        return response.data
+        return FastJSONResponse(project_rows(response.data, ChatResponse))
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Get chats error: {str(e)}")
+        logger.error("Get chats error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch chats"
@@ -381,17 +764,16 @@ async def create_chat(current_user: dict = Depends(get_current_user)):
             "title": "New Conversation"
         }
         
-        if supabase_admin:
-            response = supabase_admin.table("chats").insert(chat_data).execute()
-        else:
-            response = supabase.table("chats").insert(chat_data).execute()
+        response = await db_execute(_db().table("chats").insert(chat_data))
             
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create chat")
             
         return response.data[0]
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Create chat error: {str(e)}")
+        logger.error("Create chat error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create chat"
@@ -404,24 +786,26 @@ async def get_chat_messages(chat_id: str, current_user: dict = Depends(get_curre
     """
     try:
         # Verify chat ownership
-        if supabase_admin:
-            chat_check = supabase_admin.table("chats").select("id").eq("id", chat_id).eq("user_id", current_user["id"]).execute()
-        else:
-            chat_check = supabase.table("chats").select("id").eq("id", chat_id).eq("user_id", current_user["id"]).execute()
+        chat_check = await db_execute(_db().table("chats").select("*").eq("id", chat_id).eq("user_id", current_user["id"]))
             
         if not chat_check.data:
             raise HTTPException(status_code=404, detail="Chat not found")
 
-        if supabase_admin:
-            response = supabase_admin.table("messages").select("*").eq("chat_id", chat_id).order("created_at", desc=False).execute()
-        else:
-            response = supabase.table("messages").select("*").eq("chat_id", chat_id).order("created_at", desc=False).execute()
+        response = await db_execute(
+            _db().table("messages").select("*").eq("chat_id", chat_id)
+            .order("created_at", desc=False).order("sender", desc=True).order("id")
+        )
+        messages = project_rows(response.data, MessageResponse)
+        
+        # Older messages of archived chats live in the cold tier
+        if chat_check.data[0].get("archived_at"):
+            messages = merge_messages(await _load_archived_messages(chat_id), messages)
             
-        return response.data
-    except HTTPException:
+        return FastJSONResponse(messages)
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
-        logger.error(f"Get messages error: {str(e)}")
+        logger.error("Get messages error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch messages"
@@ -434,25 +818,19 @@ async def delete_chat(chat_id: str, current_user: dict = Depends(get_current_use
     """
     try:
         # Verify chat ownership
-        if supabase_admin:
-            chat_check = supabase_admin.table("chats").select("id").eq("id", chat_id).eq("user_id", current_user["id"]).execute()
-        else:
-            chat_check = supabase.table("chats").select("id").eq("id", chat_id).eq("user_id", current_user["id"]).execute()
+        chat_check = await db_execute(_db().table("chats").select("id").eq("id", chat_id).eq("user_id", current_user["id"]))
             
         if not chat_check.data:
             raise HTTPException(status_code=404, detail="Chat not found or access denied")
 
         # Delete chat (messages will cascade delete due to foreign key constraint)
-        if supabase_admin:
-            supabase_admin.table("chats").delete().eq("id", chat_id).execute()
-        else:
-            supabase.table("chats").delete().eq("id", chat_id).execute()
+        await db_execute(_db().table("chats").delete().eq("id", chat_id))
             
         return {"message": "Chat deleted successfully", "id": chat_id}
-    except HTTPException:
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
-        logger.error(f"Delete chat error: {str(e)}")
+        logger.error("Delete chat error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete chat"
@@ -490,14 +868,12 @@ async def process_image_ocr(
         if not active_chat_id:
             try:
                 chat_data = {"user_id": current_user["id"], "title": "Image Analysis"}
-                if supabase_admin:
-                    chat_res = supabase_admin.table("chats").insert(chat_data).execute()
-                else:
-                    chat_res = supabase.table("chats").insert(chat_data).execute()
+                chat_res = await db_execute(_db().table("chats").insert(chat_data))
                 if chat_res.data:
                     active_chat_id = chat_res.data[0]["id"]
             except Exception as e:
-                logger.error(f"Failed to create auto-chat: {e}")
+                logger.error("Failed to create auto-chat: %s", e)
+        bind_log_context(chat_id=active_chat_id)
 
         # Process image with Gemini Vision
         extracted_text = ""
@@ -512,40 +888,20 @@ async def process_image_ocr(
             
             if gemini_api_key:
                 # Use Gemini Vision for direct image analysis
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                
-                prompt = f"""
-                You are Civic-AI, an expert AI assistant.
-                
-                Please analyze this image of a government document or notice.
-                
-                Return a JSON response with two fields:
-                1. "extracted_text": The full text extracted from the image.
-                2. "explanation": A simple, clear explanation of what the document is about, including key actions, dates, or requirements.
-                
-                The "explanation" should be in {language} and formatted in Markdown.
-                """
-                
-                response = model.generate_content([prompt, image], generation_config={"response_mime_type": "application/json"})
-                
-                try:
-                    import json
-                    response_data = json.loads(response.text)
-                    extracted_text = response_data.get("extracted_text", "Text could not be extracted.")
-                    ai_explanation = response_data.get("explanation", "Analysis could not be generated.")
-                except Exception as json_error:
-                    logger.error(f"JSON parsing error: {json_error}")
-                    extracted_text = "Error parsing AI response."
-                    ai_explanation = response.text # Fallback to raw text
+                analysis = await analyze_document_image(image, language)
+                extracted_text = analysis["extracted_text"]
+                ai_explanation = analysis["explanation"]
             else:
                 # Fallback if no API key
                 logger.warning("Gemini API key missing. Using fallback.")
+                bind_log_context(fallback=True)
                 fallback_data = get_image_fallback_response(language)
                 extracted_text = fallback_data["extracted_text"]
                 ai_explanation = fallback_data["explanation"]
                 
         except Exception as ocr_error:
-            logger.error(f"Image processing error: {str(ocr_error)}")
+            logger.error("Image processing error: %s", ocr_error)
+            bind_log_context(fallback=True)
             # Use smart fallback on error
             fallback_data = get_image_fallback_response(language)
             extracted_text = fallback_data["extracted_text"]
@@ -570,18 +926,12 @@ async def process_image_ocr(
                     "content": ai_explanation
                 }
                 
-                if supabase_admin:
-                    supabase_admin.table("messages").insert([user_msg, ai_msg]).execute()
-                    # Update chat title based on first message if needed, or just update timestamp
-                    supabase_admin.table("chats").update({"updated_at": "now()"}).eq("id", active_chat_id).execute()
-                else:
-                    supabase.table("messages").insert([user_msg, ai_msg]).execute()
-                    supabase.table("chats").update({"updated_at": "now()"}).eq("id", active_chat_id).execute()
+                await persist_chat_messages(active_chat_id, [user_msg, ai_msg])
                     
             except Exception as db_error:
-                logger.error(f"Failed to save messages: {db_error}")
+                logger.error("Failed to save messages: %s", db_error)
 
-        logger.info(f"Image processed successfully for user {current_user['id']}")
+        logger.info("Image processed successfully for user %s", current_user['id'])
         
         return OCRResponse(
             extracted_text=extracted_text,
@@ -591,10 +941,10 @@ async def process_image_ocr(
             chat_id=active_chat_id
         )
     
-    except HTTPException:
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
-        logger.error(f"Image upload error: {str(e)}")
+        logger.error("Image upload error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to process the uploaded image"
@@ -620,18 +970,16 @@ async def ask_ai(data: QueryRequest, current_user: dict = Depends(get_current_us
                 title = " ".join(data.question.split()[:5]) + "..."
                 chat_data = {"user_id": current_user["id"], "title": title}
                 
-                if supabase_admin:
-                    chat_res = supabase_admin.table("chats").insert(chat_data).execute()
-                else:
-                    chat_res = supabase.table("chats").insert(chat_data).execute()
+                chat_res = await db_execute(_db().table("chats").insert(chat_data))
                     
                 if chat_res.data:
                     active_chat_id = chat_res.data[0]["id"]
             except Exception as e:
-                logger.error(f"Failed to create auto-chat: {e}")
+                logger.error("Failed to create auto-chat: %s", e)
+        bind_log_context(chat_id=active_chat_id)
 
         # Generate AI response
-        ai_response = generate_ai_response(data.question, data.language)
+        ai_response = await generate_ai_response(data.question, data.language)
         
         # Save messages to database if we have a chat_id
         if active_chat_id:
@@ -650,17 +998,12 @@ async def ask_ai(data: QueryRequest, current_user: dict = Depends(get_current_us
                     "content": ai_response
                 }
                 
-                if supabase_admin:
-                    supabase_admin.table("messages").insert([user_msg, ai_msg]).execute()
-                    supabase_admin.table("chats").update({"updated_at": "now()"}).eq("id", active_chat_id).execute()
-                else:
-                    supabase.table("messages").insert([user_msg, ai_msg]).execute()
-                    supabase.table("chats").update({"updated_at": "now()"}).eq("id", active_chat_id).execute()
+                await persist_chat_messages(active_chat_id, [user_msg, ai_msg])
                     
             except Exception as db_error:
-                logger.error(f"Failed to save messages: {db_error}")
+                logger.error("Failed to save messages: %s", db_error)
         
-        logger.info(f"Query processed successfully for user {current_user['id']}")
+        logger.info("Query processed successfully for user %s", current_user['id'])
         
         return {
             "answer": ai_response,
@@ -671,19 +1014,484 @@ async def ask_ai(data: QueryRequest, current_user: dict = Depends(get_current_us
             "status": "success"
         }
     
-    except HTTPException:
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
-        logger.error(f"Query processing error: {str(e)}")
+        logger.error("Query processing error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to process your query"
         )
 
+# Export Routes
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+
+async def _fetch_keyset_page(query, cursor, page_size: int, order=CHAT_ORDER) -> list:
+    """
+    Fetch one page of rows sorted by `order`, starting after the cursor
+    """
+    if cursor:
+        query = query.or_(keyset_filter(cursor, order))
+    for column, descending in order:
+        query = query.order(column, desc=descending)
+    response = await db_execute(query.limit(page_size))
+    return response.data or []
+
+async def _export_records(user_id: str):
+    """
+    Yield the user's chats, each followed by its messages, one page at a time
+    """
+    yield [{"type": "export", "user_id": user_id, "exported_at": datetime.now(timezone.utc).isoformat()}]
+
+    chat_count = 0
+    message_count = 0
+    complete = True
+    try:
+        chat_pages = keyset_pages(
+            lambda cursor, size: _fetch_keyset_page(
+                _db().table("chats").select("*").eq("user_id", user_id), cursor, size
+            ),
+            EXPORT_PAGE_SIZE,
+        )
+        async for chats in chat_pages:
+            for chat in chats:
+                chat_count += 1
+                yield [{"type": "chat", **project_rows([chat], ChatResponse)[0]}]
+
+                archived_ids = set()
+                if chat.get("archived_at"):
+                    archived = await _load_archived_messages(chat["id"])
+                    archived_ids = {message["id"] for message in archived}
+                    for start in range(0, len(archived), EXPORT_PAGE_SIZE):
+                        page = archived[start:start + EXPORT_PAGE_SIZE]
+                        message_count += len(page)
+                        yield [{"type": "message", **message} for message in page]
+
+                message_pages = keyset_pages(
+                    lambda cursor, size, chat_id=chat["id"]: _fetch_keyset_page(
+                        _db().table("messages").select("*").eq("chat_id", chat_id), cursor, size, MESSAGE_ORDER
+                    ),
+                    EXPORT_PAGE_SIZE,
+                    MESSAGE_ORDER,
+                )
+                async for messages in message_pages:
+                    # A pass interrupted before its delete leaves messages both archived and hot
+                    messages = [message for message in messages if message["id"] not in archived_ids]
+                    message_count += len(messages)
+                    yield [{"type": "message", **message} for message in project_rows(messages, MessageResponse)]
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        logger.error("Export error: %s", e)
+        complete = False
+
+    yield [{"type": "end", "chats": chat_count, "messages": message_count, "complete": complete}]
+
+@app.get("/api/export")
+async def export_chats(gzip: bool = False, current_user: dict = Depends(get_current_user)):
+    """
+    Stream all of the current user's chats and messages as NDJSON (Protected Route)
+    """
+    filename = "civic-ai-export.ndjson.gz" if gzip else "civic-ai-export.ndjson"
+    return StreamingResponse(
+        encode_ndjson(_export_records(current_user["id"]), compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Message Archive
+# Chats idle for ARCHIVE_AFTER_DAYS have their messages compacted into chat_archives
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_MAX_CHATS_PER_PASS = int(os.getenv("ARCHIVE_MAX_CHATS_PER_PASS", "1000"))
+# How long a worker holds its claim on a chat while archiving it
+ARCHIVE_CLAIM_SECONDS = float(os.getenv("ARCHIVE_CLAIM_SECONDS", "600"))
+# Ids per delete request, keeping the PostgREST URL short
+ARCHIVE_DELETE_CHUNK = 200
+# Oldest idle chats first
+ARCHIVABLE_ORDER = (("updated_at", False), ("id", False))
+
+async def _load_archived_messages(chat_id: str) -> list:
+    """
+    Rehydrate a chat's archived messages into the MessageResponse shape
+    """
+    response = await db_execute(_db().table("chat_archives").select("payload").eq("chat_id", chat_id))
+    if not response.data:
+        return []
+    return await asyncio.to_thread(unpack_messages, response.data[0]["payload"])
+
+async def _claim_chat_for_archive(chat_id: str) -> bool:
+    """
+    Take an expiring claim on a chat so only one worker, on any node, archives it at a time
+    """
+    now = datetime.now(timezone.utc)
+    until = (now + timedelta(seconds=ARCHIVE_CLAIM_SECONDS)).isoformat()
+    response = await db_execute(
+        _db().table("chats").update({"archive_claimed_until": until}).eq("id", chat_id)
+        .or_(f'archive_claimed_until.is.null,archive_claimed_until.lt."{now.isoformat()}"')
+    )
+    return bool(response.data)
+
+async def _release_chat_claim(chat_id: str) -> None:
+    await db_execute(_db().table("chats").update({"archive_claimed_until": None}).eq("id", chat_id))
+
+async def archive_chat(chat_id: str) -> Optional[int]:
+    """
+    Move a chat's hot messages into its compressed archive, merging with any
+    earlier archive. Returns the number of messages moved, or None when another
+    worker holds the chat.
+    """
+    if not await _claim_chat_for_archive(chat_id):
+        return None
+    try:
+        return await _archive_claimed_chat(chat_id)
+    finally:
+        try:
+            await _release_chat_claim(chat_id)
+        except Exception as e:
+            # The claim expires on its own
+            logger.warning("Failed to release archive claim on chat %s: %s", chat_id, e)
+
+async def _archive_claimed_chat(chat_id: str) -> int:
+    hot = []
+    async for page in keyset_pages(
+        lambda cursor, size: _fetch_keyset_page(
+            _db().table("messages").select("*").eq("chat_id", chat_id), cursor, size, MESSAGE_ORDER
+        ),
+        EXPORT_PAGE_SIZE,
+        MESSAGE_ORDER,
+    ):
+        hot.extend(project_rows(page, MessageResponse))
+    
+    archived_at = datetime.now(timezone.utc).isoformat()
+    if hot:
+        messages = merge_messages(await _load_archived_messages(chat_id), hot)
+        payload = await asyncio.to_thread(pack_messages, messages)
+        await db_execute(_db().table("chat_archives").upsert({
+            "chat_id": chat_id,
+            "payload": payload,
+            "message_count": len(messages),
+            "archived_at": archived_at
+        }, on_conflict="chat_id"))
+    
+    await db_execute(_db().table("chats").update({"archived_at": archived_at}).eq("id", chat_id))
+    
+    # Delete only what was archived; anything written meanwhile stays hot
+    ids = [message["id"] for message in hot]
+    for start in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+        await db_execute(_db().table("messages").delete().in_("id", ids[start:start + ARCHIVE_DELETE_CHUNK]))
+    
+    return len(hot)
+
+async def run_archive_pass() -> dict:
+    """
+    Archive chats that have been idle past the cutoff and have unarchived messages
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    chats_archived = 0
+    messages_moved = 0
+    failures = 0
+    
+    async for chats in keyset_pages(
+        lambda cursor, size: _fetch_keyset_page(
+            _db().table("archivable_chats").select("id, updated_at").lt("updated_at", cutoff),
+            cursor, size, ARCHIVABLE_ORDER
+        ),
+        ARCHIVE_BATCH_SIZE,
+        ARCHIVABLE_ORDER,
+    ):
+        for chat in chats:
+            try:
+                moved = await archive_chat(chat["id"])
+                if moved is None:
+                    continue
+                messages_moved += moved
+                chats_archived += 1
+            except Exception as e:
+                failures += 1
+                logger.error("Failed to archive chat %s: %s", chat["id"], e)
+        if chats_archived + failures >= ARCHIVE_MAX_CHATS_PER_PASS:
+            break
+    
+    summary = {"chats": chats_archived, "messages": messages_moved, "failures": failures}
+    logger.info("Archive pass finished: %s", summary)
+    return summary
+
+async def archive_loop() -> None:
+    """
+    Run archive passes on an interval. Going through the shared cache usually
+    leaves one worker per node scanning; correctness does not depend on it,
+    since each chat is claimed in the database before it is archived.
+    """
+    while True:
+        try:
+            await cache.get_or_compute("archive:pass", run_archive_pass, ttl=ARCHIVE_INTERVAL_SECONDS)
+        except Exception as e:
+            logger.error("Archive pass error: %s", e)
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+# Realtime Chat Channel
+async def _authenticate_websocket(websocket: WebSocket) -> Optional[dict]:
+    """
+    Resolve the user once per connection.
+    Accepts a bearer Authorization header or a first {"type": "auth", "token": ...} frame,
+    since browsers cannot set headers on WebSocket requests.
+    Raises DeadlineExceeded when Supabase does not answer within the auth budget.
+    """
+    token = None
+    auth_header = websocket.headers.get("authorization", "")
+    if auth_header.lower().startswith("bearer "):
+        token = auth_header[7:].strip()
+    else:
+        try:
+            frame = await asyncio.wait_for(websocket.receive_json(), WS_AUTH_TIMEOUT_SECONDS)
+        except Exception:
+            return None
+        if isinstance(frame, dict) and frame.get("type") == "auth":
+            token = frame.get("token")
+
+    if not token:
+        return None
+
+    try:
+        return await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        return None
+
+async def _iterate_in_thread(iterator, executor=None):
+    """
+    Drive a blocking iterator from a worker thread without stalling the event loop
+    """
+    sentinel = object()
+    while True:
+        item = await in_executor(executor, next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+async def _ws_answer_query(connection: ChatConnection, frame: dict) -> None:
+    """
+    Answer one query frame, streaming partial answers back on the socket
+    """
+    request_id = frame.get("id")
+    question = str(frame.get("question") or "")
+    language = str(frame.get("language") or "en")
+    chat_id = frame.get("chat_id")
+    log_context = new_log_context(chat_id=chat_id, fallback=False)
+    started = time.perf_counter()
+
+    if not question.strip():
+        await connection.send({"type": "error", "id": request_id, "detail": "Question cannot be empty"}, WS_SEND_TIMEOUT_SECONDS)
+        return
+
+    try:
+        if chat_id:
+            if not await _chat_is_owned_by(chat_id, connection.user_id):
+                await connection.send({"type": "error", "id": request_id, "detail": "Chat not found"}, WS_SEND_TIMEOUT_SECONDS)
+                return
+        else:
+            # Create chat if not provided, titled like the HTTP query route
+            try:
+                title = " ".join(question.split()[:5]) + "..."
+                chat_id = await _create_chat(connection.user_id, title)
+            except Exception as e:
+                logger.error("Failed to create auto-chat: %s", e)
+            if chat_id:
+                log_context["chat_id"] = chat_id
+                await connection.send({"type": "chat.created", "id": request_id, "chat_id": chat_id}, WS_SEND_TIMEOUT_SECONDS)
+
+        if chat_id:
+            chat_hub.subscribe(connection, chat_id)
+
+        # Stream the answer, switching to the fallback if Gemini fails at any point
+        answer_parts = []
+        fallback = False
+        cache_key = answer_cache_key(question, language)
+        cached_answer = await cache.aget(cache_key)
+        try:
+            if cached_answer:
+                answer_parts.append(cached_answer)
+                await connection.send({"type": "answer.delta", "id": request_id, "chat_id": chat_id, "delta": cached_answer}, WS_SEND_TIMEOUT_SECONDS)
+            else:
+                async for delta in _iterate_in_thread(stream_ai_response(question, language), model_executor):
+                    if connection.closed:
+                        return
+                    answer_parts.append(delta)
+                    await connection.send({"type": "answer.delta", "id": request_id, "chat_id": chat_id, "delta": delta}, WS_SEND_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error("AI streaming error: %s", e)
+            fallback = True
+            log_context["fallback"] = True
+
+        answer = generate_fallback_response(question, language) if fallback else "".join(answer_parts)
+
+        if not fallback and not cached_answer and answer:
+            await cache.aset(cache_key, answer, ANSWER_CACHE_TTL_SECONDS)
+
+        messages = []
+        if chat_id:
+            try:
+                messages = await persist_chat_messages(
+                    chat_id,
+                    [
+                        {"chat_id": chat_id, "sender": "user", "content": question},
+                        {"chat_id": chat_id, "sender": "ai", "content": answer},
+                    ],
+                    exclude=connection,
+                )
+            except Exception as db_error:
+                logger.error("Failed to save messages: %s", db_error)
+
+        await connection.send({
+            "type": "answer.done",
+            "id": request_id,
+            "chat_id": chat_id,
+            "answer": answer,
+            "fallback": fallback,
+            "messages": messages,
+        }, WS_SEND_TIMEOUT_SECONDS)
+
+        log_context["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        logger.info("WebSocket query answered")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error("WebSocket query error: %s", e)
+        await connection.send({"type": "error", "id": request_id, "detail": "Failed to process your query"}, WS_SEND_TIMEOUT_SECONDS)
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """
+    Multiplexed realtime chat channel (Protected Route)
+
+    Client frames: auth, subscribe, unsubscribe, query, ping, pong.
+    Server frames: ready, subscribed, unsubscribed, chat.created, answer.delta,
+    answer.done, message, ping, pong, error.
+    """
+    await websocket.accept()
+    new_log_context(route="/ws/chat")
+
+    try:
+        current_user = await _authenticate_websocket(websocket)
+    except DeadlineExceeded as e:
+        logger.warning("WebSocket authentication timed out: %s", e)
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Authentication timed out")
+        return
+    if not current_user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication credentials")
+        return
+
+    connection = ChatConnection(websocket, current_user["id"], max_queue=WS_MAX_QUEUE)
+    writer = asyncio.create_task(connection.writer())
+    heartbeat = asyncio.create_task(connection.heartbeat(WS_HEARTBEAT_SECONDS))
+    connection.offer({"type": "ready", "user_id": current_user["id"]})
+
+    try:
+        while not connection.closed:
+            try:
+                frame = await asyncio.wait_for(websocket.receive_json(), WS_IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                await connection.close(reason="Heartbeat timeout")
+                break
+            except ValueError:
+                await connection.send({"type": "error", "detail": "Frames must be JSON objects"}, WS_SEND_TIMEOUT_SECONDS)
+                continue
+
+            if not isinstance(frame, dict):
+                await connection.send({"type": "error", "detail": "Frames must be JSON objects"}, WS_SEND_TIMEOUT_SECONDS)
+                continue
+
+            frame_type = frame.get("type")
+            chat_id = frame.get("chat_id")
+
+            if frame_type == "pong":
+                continue
+            elif frame_type == "ping":
+                await connection.send({"type": "pong"}, WS_SEND_TIMEOUT_SECONDS)
+            elif frame_type == "subscribe":
+                if chat_id and await _chat_is_owned_by(chat_id, connection.user_id):
+                    chat_hub.subscribe(connection, chat_id)
+                    await connection.send({"type": "subscribed", "chat_id": chat_id}, WS_SEND_TIMEOUT_SECONDS)
+                else:
+                    await connection.send({"type": "error", "chat_id": chat_id, "detail": "Chat not found"}, WS_SEND_TIMEOUT_SECONDS)
+            elif frame_type == "unsubscribe":
+                chat_hub.unsubscribe(connection, chat_id)
+                await connection.send({"type": "unsubscribed", "chat_id": chat_id}, WS_SEND_TIMEOUT_SECONDS)
+            elif frame_type == "query":
+                if len(connection.tasks) >= WS_MAX_INFLIGHT:
+                    await connection.send({"type": "error", "id": frame.get("id"), "detail": "Too many queries in flight"}, WS_SEND_TIMEOUT_SECONDS)
+                    continue
+                task = asyncio.create_task(_ws_answer_query(connection, frame))
+                connection.tasks.add(task)
+                task.add_done_callback(connection.tasks.discard)
+            else:
+                await connection.send({"type": "error", "detail": f"Unknown frame type: {frame_type}"}, WS_SEND_TIMEOUT_SECONDS)
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        if not connection.closed:
+            logger.error("WebSocket error: %s", e)
+    finally:
+        chat_hub.disconnect(connection)
+        writer.cancel()
+        heartbeat.cancel()
+        await connection.close()
+
+# Readiness Probes
+READY_PROBE_INTERVAL_SECONDS = float(os.getenv("READY_PROBE_INTERVAL_SECONDS", "10"))
+READY_REQUIRE_GEMINI = os.getenv("READY_REQUIRE_GEMINI", "true").lower() == "true"
+READY_REQUIRE_WARMUP = os.getenv("READY_REQUIRE_WARMUP", "true").lower() == "true"
+
+async def _probe_supabase() -> None:
+    await db_execute(_db().table("users").select("id").limit(1))
+
+async def _probe_gemini() -> None:
+    if not gemini_api_key:
+        raise RuntimeError("Gemini API key missing")
+    # Model metadata lookup: authenticated, but generates no tokens
+    await run_blocking(genai.get_model, "models/gemini-1.5-flash", cap=AUTH_TIMEOUT_SECONDS)
+
+async def _probe_cache() -> None:
+    await asyncio.to_thread(cache.get, "ready:probe")
+
+readiness_monitor = ReadinessMonitor(
+    [
+        DependencyProbe("supabase", _probe_supabase, critical=True, timeout=DB_TIMEOUT_SECONDS),
+        # Without a key every answer is a fallback by design, so Gemini only gates readiness when configured
+        DependencyProbe("gemini", _probe_gemini, critical=READY_REQUIRE_GEMINI and bool(gemini_api_key), timeout=AUTH_TIMEOUT_SECONDS),
+        DependencyProbe("cache", _probe_cache, critical=False, timeout=1.0),
+    ],
+    interval=READY_PROBE_INTERVAL_SECONDS,
+)
+if READY_REQUIRE_WARMUP:
+    readiness_monitor.add_gate("warmup", lambda: warmup_job.done)
+
 # Health check endpoint (public)
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "timestamp": "2024-12-29T12:00:00Z"}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "warmup": warmup_job.progress(),
+        "hedging": {
+            "text": text_model_hedger.stats(),
+            "vision": vision_model_hedger.stats(),
+        },
+        "cache": cache.stats(),
+    }
+
+# Readiness endpoint (public) for load balancers and rolling deploys.
+# Served from cached probe results; never calls a dependency itself.
+@app.get("/ready")
+def readiness_check():
+    readiness = readiness_monitor.status()
+    readiness["timestamp"] = datetime.now(timezone.utc).isoformat()
+    readiness["warmup"] = warmup_job.progress()
+    return FastJSONResponse(
+        readiness,
+        status_code=status.HTTP_200_OK if readiness["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
 
 """
 SQL for creating the users table in Supabase:
@@ -747,4 +1555,56 @@ CREATE POLICY "Users can access messages in their chats" ON messages
             AND chats.user_id = auth.uid()
         )
     );
+
+-- Create the profile row from signup metadata in the same transaction as the
+-- auth user. Set PROFILE_TRIGGER_ENABLED=true once this is installed.
+CREATE OR REPLACE FUNCTION public.handle_new_user()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.users (id, name, email)
+    VALUES (NEW.id, COALESCE(NEW.raw_user_meta_data->>'name', ''), NEW.email)
+    ON CONFLICT (id) DO NOTHING;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE TRIGGER on_auth_user_created AFTER INSERT ON auth.users
+    FOR EACH ROW EXECUTE FUNCTION public.handle_new_user();
+
+-- Cold tier for messages of idle chats (see ARCHIVE_AFTER_DAYS)
+ALTER TABLE chats ADD COLUMN archived_at TIMESTAMP WITH TIME ZONE;
+-- Set while a worker is archiving the chat, so concurrent passes skip it
+ALTER TABLE chats ADD COLUMN archive_claimed_until TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE chat_archives (
+    chat_id UUID PRIMARY KEY REFERENCES chats(id) ON DELETE CASCADE,
+    payload TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE chat_archives ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can access archives of their chats" ON chat_archives
+    FOR ALL USING (
+        EXISTS (
+            SELECT 1 FROM chats
+            WHERE chats.id = chat_archives.chat_id
+            AND chats.user_id = auth.uid()
+        )
+    );
+
+-- Chats with messages written since they were last archived
+CREATE VIEW archivable_chats WITH (security_invoker = true) AS
+    SELECT id, updated_at FROM chats
+    WHERE archived_at IS NULL OR archived_at < updated_at;
+
+CREATE INDEX chats_updated_idx ON chats (updated_at, id);
+
+-- Cross-worker WebSocket fan-out (see REALTIME_FANOUT_ENABLED)
+ALTER PUBLICATION supabase_realtime ADD TABLE messages;
+
+-- Keyset pagination indexes for /api/export
+CREATE INDEX chats_user_created_idx ON chats (user_id, created_at, id);
+CREATE INDEX messages_chat_created_idx ON messages (chat_id, created_at, sender DESC, id);
 """
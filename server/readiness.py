@@ -0,0 +1,87 @@
+"""
+Readiness tracking for Civic-AI.
+Dependencies are probed by a background task on an interval and the results
+cached, so load balancer checks never generate traffic to Supabase or Gemini.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DependencyProbe:
+    """
+    Last known state of one dependency.
+    """
+
+    def __init__(self, name: str, check: Callable[[], Awaitable[None]], critical: bool = True,
+                 timeout: float = 5.0):
+        self.name = name
+        self.check = check
+        self.critical = critical
+        self.timeout = timeout
+        self.state = "unknown"
+        self.latency_ms: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.consecutive_failures = 0
+
+    async def run(self) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.check(), self.timeout)
+            self.state = "up"
+            self.error = None
+            self.consecutive_failures = 0
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            if self.state != "down":
+                logger.warning("Dependency %s is down: %s", self.name, self.error)
+            self.state = "down"
+            self.consecutive_failures += 1
+        self.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.checked_at = time.time()
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "critical": self.critical,
+            "latency_ms": self.latency_ms,
+            "checked_at": self.checked_at,
+            "error": self.error,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ReadinessMonitor:
+    """
+    Runs every probe on an interval and answers readiness from the cached
+    results plus any extra gates (such as cache warm-up).
+    """
+
+    def __init__(self, probes: List[DependencyProbe], interval: float = 10.0):
+        self.probes = probes
+        self.interval = interval
+        self.gates: Dict[str, Callable[[], bool]] = {}
+
+    def add_gate(self, name: str, is_open: Callable[[], bool]) -> None:
+        self.gates[name] = is_open
+
+    async def probe_once(self) -> None:
+        await asyncio.gather(*(probe.run() for probe in self.probes))
+
+    async def run(self) -> None:
+        while True:
+            await self.probe_once()
+            await asyncio.sleep(self.interval)
+
+    def status(self) -> dict:
+        dependencies = {probe.name: probe.snapshot() for probe in self.probes}
+        gates = {name: is_open() for name, is_open in self.gates.items()}
+        ready = all(gates.values()) and all(
+            probe.state == "up" for probe in self.probes if probe.critical
+        )
+        return {"ready": ready, "dependencies": dependencies, "gates": gates}
@@ -0,0 +1,169 @@
+"""
+Realtime chat channel for Civic-AI.
+Multiplexes many chats over a single WebSocket and fans new messages out to
+every connection subscribed to the same chat. Messages saved by other workers
+or nodes arrive through a shared broker (Supabase Realtime, see main.py).
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Close code used when a client cannot keep up with its outbound queue
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class ChatConnection:
+    """
+    One authenticated WebSocket with a bounded outbound queue.
+    A single writer task drains the queue so sends never interleave.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, max_queue: int = 256):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.subscriptions: Set[str] = set()
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.tasks: Set[asyncio.Task] = set()
+        self.closed = False
+
+    def offer(self, event: dict) -> bool:
+        """
+        Queue an event without waiting. Returns False when the queue is full.
+        """
+        if self.closed:
+            return False
+        try:
+            self.outbox.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def send(self, event: dict, timeout: float) -> None:
+        """
+        Queue an event, waiting up to `timeout` seconds for room in the queue.
+        Closes the connection as a slow consumer if the queue stays full.
+        """
+        if self.closed:
+            return
+        try:
+            await asyncio.wait_for(self.outbox.put(event), timeout)
+        except asyncio.TimeoutError:
+            await self.close(SLOW_CONSUMER_CLOSE_CODE, "Client is not reading fast enough")
+
+    async def writer(self) -> None:
+        """
+        Drain the outbound queue onto the socket until the connection closes.
+        """
+        try:
+            while not self.closed:
+                event = await self.outbox.get()
+                await self.websocket.send_json(event)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info("WebSocket writer stopped for user %s: %s", self.user_id, e)
+            self.closed = True
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        current = asyncio.current_task()
+        for task in list(self.tasks):
+            if task is not current:
+                task.cancel()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def heartbeat(self, interval: float) -> None:
+        """
+        Periodically ping the client so dead peers are detected on both sides.
+        """
+        try:
+            while not self.closed:
+                await asyncio.sleep(interval)
+                if not self.offer({"type": "ping"}):
+                    await self.close(SLOW_CONSUMER_CLOSE_CODE, "Client is not reading fast enough")
+        except asyncio.CancelledError:
+            pass
+
+
+class ChatHub:
+    """
+    In-process registry of chat subscriptions.
+    Messages persisted by any route are published here so that every other
+    device of the same user watching that chat receives them. The ids of
+    recently delivered messages are remembered so the broker's echo of a
+    message saved by this process is not delivered twice.
+    """
+
+    def __init__(self, max_recent_ids: int = 10000):
+        self._subscribers: Dict[str, Set[ChatConnection]] = {}
+        self._recent_ids: "OrderedDict[str, None]" = OrderedDict()
+        self.max_recent_ids = max_recent_ids
+
+    def subscribe(self, connection: ChatConnection, chat_id: str) -> None:
+        self._subscribers.setdefault(chat_id, set()).add(connection)
+        connection.subscriptions.add(chat_id)
+
+    def unsubscribe(self, connection: ChatConnection, chat_id: str) -> None:
+        subscribers = self._subscribers.get(chat_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self._subscribers[chat_id]
+        connection.subscriptions.discard(chat_id)
+
+    def disconnect(self, connection: ChatConnection) -> None:
+        for chat_id in list(connection.subscriptions):
+            self.unsubscribe(connection, chat_id)
+
+    def publish(self, chat_id: str, event: dict, exclude: Optional[ChatConnection] = None) -> None:
+        """
+        Fan an event out to the subscribers of a chat.
+        Subscribers whose queue is full are disconnected instead of buffered.
+        """
+        for connection in list(self._subscribers.get(chat_id, ())):
+            if connection is exclude:
+                continue
+            if not connection.offer(event):
+                logger.warning("Dropping slow WebSocket consumer for user %s", connection.user_id)
+                self.disconnect(connection)
+                asyncio.create_task(
+                    connection.close(SLOW_CONSUMER_CLOSE_CODE, "Client is not reading fast enough")
+                )
+
+    def _seen(self, message_id: str) -> bool:
+        """
+        Record a delivered message id, returning True if it was already delivered.
+        """
+        if message_id in self._recent_ids:
+            return True
+        self._recent_ids[message_id] = None
+        while len(self._recent_ids) > self.max_recent_ids:
+            self._recent_ids.popitem(last=False)
+        return False
+
+    def publish_message(self, chat_id: str, message: dict, exclude: Optional[ChatConnection] = None) -> None:
+        """
+        Deliver a message saved by this process to local subscribers.
+        """
+        self._seen(message["id"])
+        self.publish(chat_id, {"type": "message", "chat_id": chat_id, "message": message}, exclude=exclude)
+
+    def publish_remote_message(self, message: dict) -> None:
+        """
+        Deliver a message relayed by the broker, unless this process saved it.
+        """
+        chat_id = message.get("chat_id")
+        if chat_id not in self._subscribers or self._seen(message["id"]):
+            return
+        self.publish(chat_id, {"type": "message", "chat_id": chat_id, "message": message})
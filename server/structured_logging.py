@@ -0,0 +1,196 @@
+"""
+Structured, non-blocking logging for Civic-AI.
+Request paths only enqueue log records; a background thread formats them as
+JSON lines and writes them out, so a slow log collector never stalls the
+event loop. Success logs can be sampled per route.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+_log_context: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("log_context", default=None)
+
+# Fields every JSON record may carry, taken from the request's log context
+CONTEXT_FIELDS = ("route", "method", "user_id", "chat_id", "status", "latency_ms", "fallback")
+
+
+def new_log_context(**fields) -> dict:
+    """
+    Start a fresh log context (per request, per WebSocket query) that inherits
+    the current one. Returns the mutable context dict.
+    """
+    context = dict(_log_context.get() or {})
+    context.update(fields)
+    _log_context.set(context)
+    return context
+
+
+def bind_log_context(**fields) -> None:
+    """
+    Attach fields (user id, chat id, fallback flag, ...) to the current context.
+    The dict is shared with tasks and threads spawned from the request.
+    """
+    context = _log_context.get()
+    if context is None:
+        new_log_context(**fields)
+    else:
+        context.update(fields)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Snapshots the request context onto each record and drops sub-WARNING
+    records from requests that were not sampled.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context is None:
+            return True
+        if record.levelno < logging.WARNING and context.get("sampled") is False:
+            return False
+        record.context = dict(context)
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks and never formats on the calling thread.
+    Records are dropped (and counted) when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is deferred to the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        context = getattr(record, "context", None)
+        if context:
+            for field in CONTEXT_FIELDS:
+                if context.get(field) is not None:
+                    payload[field] = context[field]
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+# Configured by uvicorn before the app is imported
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+
+def configure_logging(level: int = logging.INFO, queue_size: int = 10000) -> NonBlockingQueueHandler:
+    """
+    Route the root logger through a bounded queue to a JSON stdout writer thread.
+    Uvicorn's own loggers write to stdout directly and do not propagate, so
+    they are rerouted through the root logger as well.
+    """
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    for name in UVICORN_LOGGERS:
+        server_logger = logging.getLogger(name)
+        server_logger.handlers = []
+        server_logger.propagate = True
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """
+    Parse "/api/query=0.1,/health=0" into a route-prefix -> rate mapping.
+    """
+    rates = {}
+    for item in spec.split(","):
+        prefix, _, rate = item.strip().partition("=")
+        if prefix and rate:
+            rates[prefix] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware that opens a log context per request, decides up front
+    whether the request's success logs are sampled, and writes one access
+    record with status and latency. Errors and fallbacks are always logged.
+    """
+
+    def __init__(self, app, default_rate: float = 1.0, route_rates: Optional[Dict[str, float]] = None):
+        self.app = app
+        self.default_rate = default_rate
+        # Longest prefix first so the most specific route wins
+        self.route_rates = sorted((route_rates or {}).items(), key=lambda item: -len(item[0]))
+        self.logger = logging.getLogger("civic_ai.access")
+
+    def _rate_for(self, path: str) -> float:
+        for prefix, rate in self.route_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope.get("path", "")
+        rate = self._rate_for(path)
+        context = new_log_context(
+            route=path,
+            method=scope.get("method"),
+            sampled=rate >= 1.0 or random.random() < rate,
+        )
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                context["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                context["route"] = route.path
+            context["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            if context.get("status", 500) >= 400 or context.get("fallback"):
+                context["sampled"] = True
+            self.logger.info("request completed")
@@ -0,0 +1,145 @@
+"""
+Answer cache warm-up for Civic-AI.
+Finds the most frequently asked questions, from chat history or an exported
+file, and pre-computes their answers with bounded concurrency so the first
+wave of traffic after a deploy does not all go to Gemini at once.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+Question = Tuple[str, str]  # (question, language)
+
+# User messages written by the OCR route rather than typed by the user
+IMAGE_MESSAGE_PREFIX = "**Image Uploaded:**"
+
+
+def top_questions(texts: Iterable[str], languages: List[str], limit: int) -> List[Question]:
+    """
+    Rank questions by how often their normalised form occurs and pair each of
+    the top `limit` with every warm-up language. The most common spelling of
+    each question is kept as the text to send.
+    """
+    counts: Counter = Counter()
+    spellings: Dict[str, Counter] = {}
+    for text in texts:
+        if not text or text.startswith(IMAGE_MESSAGE_PREFIX):
+            continue
+        normalized = normalize_question(text)
+        if not normalized:
+            continue
+        counts[normalized] += 1
+        spellings.setdefault(normalized, Counter())[text.strip()] += 1
+
+    ranked = [spellings[normalized].most_common(1)[0][0] for normalized, _ in counts.most_common(limit)]
+    return [(question, language) for language in languages for question in ranked]
+
+
+def load_questions_file(path: str, languages: List[str], limit: int) -> List[Question]:
+    """
+    Read warm-up questions from a file of JSON lines such as
+    {"question": "...", "language": "hi", "count": 120}. Lines without a
+    language are warmed for every warm-up language. Plain text lines are
+    treated as questions with a count of 1.
+    """
+    weighted: Counter = Counter()
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = {"question": line}
+            if not isinstance(record, dict) or not record.get("question"):
+                continue
+            targets = [record["language"]] if record.get("language") else languages
+            for language in targets:
+                weighted[(record["question"].strip(), language)] += int(record.get("count", 1))
+
+    by_language: Dict[str, List[Question]] = {}
+    for (question, language), _ in weighted.most_common():
+        bucket = by_language.setdefault(language, [])
+        if len(bucket) < limit:
+            bucket.append((question, language))
+    return [question for bucket in by_language.values() for question in bucket]
+
+
+class WarmupJob:
+    """
+    Pre-computes answers for a list of questions and tracks progress for the
+    health and readiness endpoints.
+    """
+
+    def __init__(self, answer: Callable[[str, str], Awaitable[Any]],
+                 is_cached: Callable[[str, str], Awaitable[bool]], concurrency: int = 4):
+        self.answer = answer
+        self.is_cached = is_cached
+        self.concurrency = concurrency
+        self.status = "pending"
+        self.total = 0
+        self.completed = 0
+        self.already_cached = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("complete", "failed", "disabled")
+
+    def progress(self) -> dict:
+        warmed = self.completed + self.already_cached
+        return {
+            "status": self.status,
+            "total": self.total,
+            "warmed": warmed,
+            "failed": self.failed,
+            "coverage": round(warmed / self.total, 3) if self.total else None,
+            "duration_seconds": round((self.finished_at or time.time()) - self.started_at, 1)
+            if self.started_at else None,
+        }
+
+    def disable(self) -> None:
+        self.status = "disabled"
+
+    async def run(self, load_questions: Callable[[], Awaitable[List[Question]]]) -> None:
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            questions = await load_questions()
+            self.total = len(questions)
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def warm(question: str, language: str) -> None:
+                async with semaphore:
+                    if await self.is_cached(question, language):
+                        self.already_cached += 1
+                        return
+                    try:
+                        await self.answer(question, language)
+                        self.completed += 1
+                    except Exception as e:
+                        self.failed += 1
+                        logger.warning("Warm-up failed for a %s question: %s", language, e)
+
+            await asyncio.gather(*(warm(question, language) for question, language in questions))
+            self.status = "complete"
+            logger.info("Cache warm-up finished: %s", self.progress())
+        except asyncio.CancelledError:
+            self.status = "failed"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            logger.error("Cache warm-up error: %s", e)
+        finally:
+            self.finished_at = time.time()